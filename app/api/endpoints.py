@@ -1,7 +1,14 @@
 # app/api/endpoints.py
+import asyncio
 import os
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 import httpx
+import msgspec
+import numpy as np
+import orjson
+import redis.asyncio as aioredis
+from cachetools import TTLCache
+from urllib.parse import urlencode
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, Tuple, List
 
@@ -9,6 +16,11 @@ router = APIRouter()
 
 OPENAQ_BASE = "https://api.openaq.org/v3"
 API_KEY = os.getenv("OPENAQ_API_KEY")
+# upstream responses are cached in redis for one ingest interval by default
+OPENAQ_CACHE_TTL = int(os.getenv("OPENAQ_CACHE_SECONDS", str(int(os.getenv("INGEST_MINUTES", "10")) * 60)))
+# finished /city responses are cached in-process for this long
+CITY_CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+redis = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), socket_connect_timeout=1, socket_timeout=1)
 PM25_BREAKPOINTS = [
     (0.0, 30.0, 0, 50),
     (30.0, 60.0, 51, 100),
@@ -29,88 +41,174 @@ PM10_BREAKPOINTS = [
 ]
 
 
-def linear_interpolate(C: float, bp: Tuple[float, float, int, int]) -> Optional[float]:
-    C_low, C_high, I_low, I_high = bp
-    if C is None:
-        return None
-    if C_low <= C <= C_high:
-        span_C = (C_high - C_low)
-        if span_C == 0:
-            return float(I_low)
-        slope = (I_high - I_low) / span_C
-        I = slope * (C - C_low) + I_low
-        return I
-    return None
+def build_subindex_fn(breakpoints: List[Tuple[float, float, int, int]], name: str):
+    # generate a get_subindex specialized to one table, with bounds and slopes inlined as literals
+    # c != c catches NaN, which would otherwise fall through to int(round(nan))
+    lines = [f"def {name}(c):", "    if c is None or c != c:", "        return None",
+             f"    if c < {float(breakpoints[0][0])!r}:", "        return None"]
+    for i, (C_low, C_high, I_low, I_high) in enumerate(breakpoints):
+        slope = (I_high - I_low) / (C_high - C_low) if C_high != C_low else 0.0
+        expr = f"int(round({slope!r} * (c - {float(C_low)!r}) + {I_low!r}))"
+        if i == len(breakpoints) - 1:
+            # if above highest defined breakpoint, extrapolate using last interval
+            lines.append(f"    return {expr}")
+        else:
+            lines += [f"    if c <= {float(C_high)!r}:", f"        return {expr}"]
+    namespace: Dict[str, Any] = {}
+    exec("\n".join(lines), namespace)
+    return namespace[name]
 
 
-def get_subindex(conc: Optional[float], breakpoints: List[Tuple[float, float, int, int]]) -> Optional[int]:
-    if conc is None:
-        return None
-    for bp in breakpoints:
-        val = linear_interpolate(conc, bp)
-        if val is not None:
-            return int(round(val))
-    # if above highest defined breakpoint, extrapolate using last interval
-    if conc > breakpoints[-1][1]:
-        Clow, Chigh, Ilow, Ihigh = breakpoints[-1]
-        span_C = (Chigh - Clow) if (Chigh - Clow) != 0 else 1
-        slope = (Ihigh - Ilow) / span_C
-        I = slope * (conc - Clow) + Ilow
-        return int(round(I))
-    return None
+get_subindex_pm25 = build_subindex_fn(PM25_BREAKPOINTS, "get_subindex_pm25")
+get_subindex_pm10 = build_subindex_fn(PM10_BREAKPOINTS, "get_subindex_pm10")
+
+
+def build_arrays(breakpoints: List[Tuple[float, float, int, int]]) -> Tuple[np.ndarray, ...]:
+    # upper bounds for searchsorted, plus C_low, slope and I_low columns for vectorized lookups
+    C_low, C_high, I_low, I_high = (np.array(col, dtype=np.float64) for col in zip(*breakpoints))
+    span_C = C_high - C_low
+    slope = np.divide(I_high - I_low, span_C, out=np.zeros_like(span_C), where=span_C != 0)
+    return C_high, C_low, slope, I_low
+
+
+PM25_ARRAYS = build_arrays(PM25_BREAKPOINTS)
+PM10_ARRAYS = build_arrays(PM10_BREAKPOINTS)
+
+
+def get_subindex_batch(concs: List[Optional[float]], arrays: Tuple[np.ndarray, ...]) -> List[Optional[int]]:
+    # sub-indices for a whole batch in one pass; None maps to NaN and back
+    highs, C_low, slope, I_low = arrays
+    c = np.array(concs, dtype=np.float64)
+    idx = np.minimum(np.searchsorted(highs, c, side="left"), len(highs) - 1)
+    lo = C_low[idx]
+    vals = np.rint(slope[idx] * (c - lo) + I_low[idx])
+    valid = ~np.isnan(c) & (c >= lo)
+    return [int(v) if ok else None for v, ok in zip(vals.tolist(), valid.tolist())]
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http
+
+
+def cache_key(endpoint: str, params: dict) -> str:
+    return "oaq:" + endpoint + ":" + urlencode(sorted(params.items()))
 
 
-async def fetch_openaq(client: httpx.AsyncClient, endpoint: str, params: dict) -> Optional[Dict[str, Any]]:
-    headers = {}
-    if API_KEY:
-        headers["X-API-Key"] = API_KEY
+async def cache_get(key: str) -> Optional[bytes]:
     try:
-        url = f"{OPENAQ_BASE}/{endpoint}"
-        resp = await client.get(url, params=params, headers=headers, timeout=20.0)
-        resp.raise_for_status()
-        return resp.json()
-    except httpx.HTTPStatusError as he:
-        # non-2xx response; log details
-        print("fetch_openaq HTTP error:", he.response.status_code, he.response.text[:1000], "endpoint:", endpoint, "params:", params)
+        return await redis.get(key)
+    except Exception as e:
+        # cache is best-effort; fall through to upstream
+        print("cache_get error:", str(e), "key:", key)
         return None
+
+
+async def cache_set(key: str, raw: bytes) -> None:
+    try:
+        await redis.setex(key, OPENAQ_CACHE_TTL, raw)
+    except Exception as e:
+        print("cache_set error:", str(e), "key:", key)
+
+
+async def fetch_openaq(client: httpx.AsyncClient, endpoint: str, params: dict, schema: Optional[type] = None) -> Any:
+    # returns plain dicts, or a decoded ``schema`` struct when one is given
+    key = cache_key(endpoint, params)
+    raw = await cache_get(key)
+    fresh = raw is None
+    if fresh:
+        headers = {}
+        if API_KEY:
+            headers["X-API-Key"] = API_KEY
+        try:
+            url = f"{OPENAQ_BASE}/{endpoint}"
+            resp = await client.get(url, params=params, headers=headers)
+            resp.raise_for_status()
+            raw = resp.content
+        except httpx.HTTPStatusError as he:
+            # non-2xx response; log details
+            print("fetch_openaq HTTP error:", he.response.status_code, he.response.text[:1000], "endpoint:", endpoint, "params:", params)
+            return None
+        except Exception as e:
+            print("fetch_openaq general error:", str(e), "endpoint:", endpoint, "params:", params)
+            return None
+    try:
+        data = orjson.loads(raw) if schema is None else msgspec.json.decode(raw, type=schema, strict=False)
     except Exception as e:
-        print("fetch_openaq general error:", str(e), "endpoint:", endpoint, "params:", params)
+        print("fetch_openaq decode error:", str(e), "endpoint:", endpoint, "params:", params)
         return None
+    if fresh:
+        # store the upstream body as-is; no need to re-serialize
+        await cache_set(key, raw)
+    return data
 
 
-def extract_from_latest(payload: Dict[str, Any]) -> Tuple[Optional[float], Optional[float], Optional[str]]:
-    if not payload:
-        return None, None, None
-    results = payload.get("results") or []
-    if not results:
+# parameter names are lowercased once, then matched against these
+_PM25 = frozenset({"pm25", "pm2.5"})
+_PM10 = "pm10"
+
+
+def pm_slot(param: Optional[str], pm25: Optional[float], pm10: Optional[float]) -> Optional[str]:
+    # which reading ("pm25" or "pm10") a measurement fills, or None for other pollutants and PMs already found
+    if not param:
+        return None
+    param = param.lower()
+    if param in _PM25:
+        return "pm25" if pm25 is None else None
+    if param == _PM10 and pm10 is None:
+        return "pm10"
+    return None
+
+
+class LatestMeasurement(msgspec.Struct):
+    parameter: Optional[str] = None
+    # converted per measurement in extract_from_latest, so one bad value can't fail the whole decode
+    value: Any = None
+    # timestamps are only passed through, so accept whatever shape upstream sends
+    lastUpdated: Any = None
+    last_updated: Any = None
+    lastUpdatedAt: Any = None
+
+
+class LatestResult(msgspec.Struct):
+    measurements: Optional[List[LatestMeasurement]] = None
+
+
+class LatestPayload(msgspec.Struct):
+    results: Optional[List[LatestResult]] = None
+
+
+def extract_from_latest(payload: Optional[LatestPayload]) -> Tuple[Optional[float], Optional[float], Optional[str]]:
+    if not payload or not payload.results:
         return None, None, None
     pm25 = None
     pm10 = None
     updated = None
     # search through results and measurements to pick pm25 and pm10
-    for res in results:
-        measurements = res.get("measurements") or []
-        for m in measurements:
-            param = (m.get("parameter") or "").lower()
-            val = m.get("value")
-            ts = m.get("lastUpdated") or m.get("last_updated") or m.get("lastUpdatedAt") or None
+    for res in payload.results:
+        for m in res.measurements or ():
+            slot = pm_slot(m.parameter, pm25, pm10)
+            if slot is None:
+                continue
             try:
-                v = float(val)
-            except Exception:
-                v = None
-            if param in ("pm25", "pm2.5") and pm25 is None and v is not None:
+                v = float(m.value)
+            except (TypeError, ValueError):
+                continue
+            if slot == "pm25":
                 pm25 = v
-                if not updated and ts:
-                    updated = ts
-            if param == "pm10" and pm10 is None and v is not None:
+            else:
                 pm10 = v
-                if not updated and ts:
-                    updated = ts
-        if pm25 is not None and pm10 is not None:
-            break
+            if not updated:
+                updated = m.lastUpdated or m.last_updated or m.lastUpdatedAt or None
+            if pm25 is not None and pm10 is not None:
+                return pm25, pm10, updated
     return pm25, pm10, updated
 
 
+async def fetch_latest(client: httpx.AsyncClient, city: str) -> Tuple[Optional[float], Optional[float], Optional[str]]:
+    payload = await fetch_openaq(client, "latest", {"country": "IN", "city": city, "limit": 20}, LatestPayload)
+    return extract_from_latest(payload)
+
+
 async def try_measurements_for_city(client: httpx.AsyncClient, city: str) -> Tuple[Optional[float], Optional[float], Optional[str]]:
     # Try to fetch recent measurements (separate endpoint) for PM2.5 and PM10
     pm25 = None
@@ -121,18 +219,21 @@ async def try_measurements_for_city(client: httpx.AsyncClient, city: str) -> Tup
     if resp:
         results = resp.get("results") or []
         for m in results:
-            p = (m.get("parameter") or "").lower()
+            # skip other pollutants and PMs we already have before doing any conversion
+            slot = pm_slot(m.get("parameter"), pm25, pm10)
+            if slot is None:
+                continue
             try:
                 v = float(m.get("value"))
             except Exception:
                 continue
-            ts = m.get("date", {}).get("utc") or m.get("date", {}).get("local") or m.get("date") or None
-            if p in ("pm25", "pm2.5") and pm25 is None:
+            if slot == "pm25":
                 pm25 = v
-                updated = updated or ts
-            if p == "pm10" and pm10 is None:
+            else:
                 pm10 = v
-                updated = updated or ts
+            if not updated:
+                date = m.get("date", {})
+                updated = date.get("utc") or date.get("local") or date or None
             if pm25 is not None and pm10 is not None:
                 break
     return pm25, pm10, updated
@@ -156,16 +257,20 @@ async def find_locations_and_try(client: httpx.AsyncClient, city: str) -> Tuple[
             pm10 = None
             updated = None
             for m in results:
-                p = (m.get("parameter") or "").lower()
+                slot = pm_slot(m.get("parameter"), pm25, pm10)
+                if slot is None:
+                    continue
                 try:
                     v = float(m.get("value"))
                 except Exception:
                     continue
-                ts = m.get("date", {}).get("utc") or m.get("date", {}).get("local") or None
-                if p in ("pm25", "pm2.5") and pm25 is None:
-                    pm25 = v; updated = updated or ts
-                if p == "pm10" and pm10 is None:
-                    pm10 = v; updated = updated or ts
+                if slot == "pm25":
+                    pm25 = v
+                else:
+                    pm10 = v
+                if not updated:
+                    date = m.get("date", {})
+                    updated = date.get("utc") or date.get("local") or None
                 if pm25 is not None and pm10 is not None:
                     return pm25, pm10, updated
     return None, None, None
@@ -176,27 +281,75 @@ async def top_cities():
     return {"cities": ["Delhi", "Mumbai", "Kolkata", "Chennai", "Hyderabad"]}
 
 
+async def first_measurement(*coros) -> Tuple[Optional[float], Optional[float], Optional[str]]:
+    # run all sources at once; return the most preferred (earliest listed) one that found data
+    tasks = [asyncio.create_task(c) for c in coros]
+    try:
+        pending = set(tasks)
+        while pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if not task.done():
+                    # a more preferred source is still running
+                    break
+                if task.exception() is not None:
+                    continue
+                pm25, pm10, updated = task.result()
+                if pm25 is not None or pm10 is not None:
+                    return pm25, pm10, updated
+        return None, None, None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# in-flight lookups by city, so concurrent requests for the same city share one upstream fetch
+_inflight: Dict[str, "asyncio.Task[bytes]"] = {}
+# serialized response bodies per city; covers deployments without redis and skips the lookup entirely when warm
+_city_cache: TTLCache = TTLCache(maxsize=1024, ttl=CITY_CACHE_TTL)
+
+
 @router.get("/city/{city}")
-async def city_endpoint(city: str):
+async def city_endpoint(city: str, client: httpx.AsyncClient = Depends(get_http_client)):
+    body = _city_cache.get(city)
+    if body is None:
+        task = _inflight.get(city)
+        if task is None:
+            task = asyncio.create_task(render_city(client, city))
+            _inflight[city] = task
+            task.add_done_callback(lambda _: _inflight.pop(city, None))
+        # shield so one client disconnecting doesn't cancel the lookup for everyone else
+        body = await asyncio.shield(task)
+    return Response(content=body, media_type="application/json")
+
+
+async def render_city(client: httpx.AsyncClient, city: str) -> bytes:
+    # serialize once; cached hits and coalesced waiters all reuse the same bytes
+    result = await lookup_city(client, city)
+    body = orjson.dumps(result)
+    # don't pin "no measurements" answers, they may be a transient upstream gap
+    if "aqi" in result:
+        _city_cache[city] = body
+    return body
+
+
+async def lookup_city(client: httpx.AsyncClient, city: str) -> Dict[str, Any]:
     city_q = city
-    async with httpx.AsyncClient() as client:
-        # 1) try latest endpoint
-        payload = await fetch_openaq(client, "latest", {"country": "IN", "city": city_q, "limit": 20})
-        pm25, pm10, updated = extract_from_latest(payload)
-        # 2) if empty, try measurements endpoint
-        if pm25 is None and pm10 is None:
-            pm25, pm10, updated = await try_measurements_for_city(client, city_q)
-        # 3) if still empty, search locations and try
-        if pm25 is None and pm10 is None:
-            pm25, pm10, updated = await find_locations_and_try(client, city_q)
+    # query latest, measurements and locations concurrently, preferring them in that order
+    pm25, pm10, updated = await first_measurement(
+        fetch_latest(client, city_q),
+        try_measurements_for_city(client, city_q),
+        find_locations_and_try(client, city_q),
+    )
 
     # nothing found
     if pm25 is None and pm10 is None:
         # return 200 with message (frontend expects JSON)
         return {"city": city, "message": "No measurements found for PM2.5 or PM10"}
 
-    sub_pm25 = get_subindex(pm25, PM25_BREAKPOINTS) if pm25 is not None else None
-    sub_pm10 = get_subindex(pm10, PM10_BREAKPOINTS) if pm10 is not None else None
+    sub_pm25 = get_subindex_pm25(pm25)
+    sub_pm10 = get_subindex_pm10(pm10)
     candidates = [x for x in (sub_pm25, sub_pm10) if x is not None]
     overall_aqi = max(candidates) if candidates else None
 
@@ -1,46 +1,72 @@
-import asyncio, os, httpx
+import asyncio, os, orjson
 from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
-from app.db import save_measurement
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from app.api.endpoints import PM10_ARRAYS, PM25_ARRAYS, get_subindex_batch
+from app.db import save_measurements_bulk
 
 OPENAQ_URL = "https://api.openaq.org/v2/latest"
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "16"))
 
-async def fetch_city(session, city):
-    try:
-        r = await session.get(OPENAQ_URL, params={"country":"IN","city":city}, timeout=20)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
-        return None
+async def fetch_city(session, sem, city):
+    async with sem:
+        try:
+            r = await session.get(OPENAQ_URL, params={"country":"IN","city":city})
+            r.raise_for_status()
+            return orjson.loads(r.content)
+        except Exception:
+            return None
 
-def parse_and_save(city, data):
-    if not data: return
+def parse_latest(data):
+    if not data: return None
     # openaq returns results list
     results = data.get("results") or []
-    if not results: return
+    if not results: return None
     # take first measurement
     measurements = results[0].get("measurements", [])
-    pm25 = None; pm10 = None; aqi = None
+    pm25 = None; pm10 = None
     for m in measurements:
-        if m.get("parameter") == "pm25":
-            pm25 = m.get("value")
-        if m.get("parameter") == "pm10":
-            pm10 = m.get("value")
-    # aqi calculation not provided — leave aqi null for now
+        param = m.get("parameter")
+        if param not in ("pm25", "pm10"): continue
+        # a non-numeric reading only drops that value, not the whole batch
+        try:
+            v = float(m.get("value"))
+        except (TypeError, ValueError):
+            continue
+        if param == "pm25":
+            pm25 = v
+        else:
+            pm10 = v
+    return pm25, pm10
+
+def save_batch(readings):
+    # readings: list of (city, pm25, pm10); sub-indices are computed for the whole batch at once
+    sub_pm25 = get_subindex_batch([r[1] for r in readings], PM25_ARRAYS)
+    sub_pm10 = get_subindex_batch([r[2] for r in readings], PM10_ARRAYS)
     ts = datetime.utcnow().isoformat()
-    save_measurement(city, ts, aqi, pm25, pm10)
+    rows = []
+    for (city, pm25, pm10), s25, s10 in zip(readings, sub_pm25, sub_pm10):
+        candidates = [x for x in (s25, s10) if x is not None]
+        aqi = max(candidates) if candidates else None
+        rows.append((city, ts, aqi, pm25, pm10))
+    save_measurements_bulk(rows)
 
-def ingest_job():
+async def ingest_job(session):
     cities = os.getenv("CITIES","Delhi,Mumbai,Kolkata,Bengaluru,Hyderabad").split(",")
-    async def _run():
-        async with httpx.AsyncClient() as session:
-            tasks = [fetch_city(session, c) for c in cities]
-            results = await asyncio.gather(*tasks)
-            for city, data in zip(cities, results):
-                parse_and_save(city, data)
-    asyncio.run(_run())
+    # bound in-flight requests so long city lists don't exhaust the shared pool
+    sem = asyncio.Semaphore(INGEST_CONCURRENCY)
+    tasks = [fetch_city(session, sem, c) for c in cities]
+    results = await asyncio.gather(*tasks)
+    readings = []
+    for city, data in zip(cities, results):
+        parsed = parse_latest(data)
+        if parsed:
+            readings.append((city, *parsed))
+    # sqlite calls block; keep them off the event loop
+    await asyncio.to_thread(save_batch, readings)
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(ingest_job, 'interval', minutes=int(os.getenv("INGEST_MINUTES", "10")))
+def start_scheduler(session):
+    # runs on the running event loop, reusing the app's shared client across ticks
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(ingest_job, 'interval', args=[session], minutes=int(os.getenv("INGEST_MINUTES", "10")))
     scheduler.start()
+    return scheduler
@@ -1,36 +1,75 @@
+import os
 import sqlite3
+import threading
 from pathlib import Path
 
-DB_FILE = Path(__file__).parent.parent / "aqi.db"
-
-def ensure():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS measurements(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        city TEXT,
-        timestamp TEXT,
-        aqi INTEGER,
-        pm25 REAL,
-        pm10 REAL
-    )""")
-    conn.commit()
-    conn.close()
+DB_FILE = Path(os.getenv("AQI_DB_FILE", Path(__file__).parent.parent / "aqi.db"))
+
+_INSERT_SQL = "INSERT INTO measurements(city, timestamp, aqi, pm25, pm10) VALUES (?,?,?,?,?)"
+# keeps one row per city with its most recent reading, so top-cities doesn't scan history
+_UPSERT_LATEST_SQL = """INSERT INTO city_latest(city, timestamp, aqi, pm25, pm10) VALUES (?,?,?,?,?)
+    ON CONFLICT(city) DO UPDATE SET
+        timestamp=excluded.timestamp, aqi=excluded.aqi, pm25=excluded.pm25, pm10=excluded.pm10
+    WHERE excluded.timestamp > city_latest.timestamp"""
+
+# one shared connection for the process; sqlite3 connections aren't safe for concurrent use, so guard it
+_CONN = None
+_LOCK = threading.Lock()
+
+def _connect():
+    # opened on first use, so importing this module doesn't touch the database; caller holds _LOCK
+    global _CONN
+    if _CONN is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        ensure(conn)
+        _CONN = conn
+    return _CONN
+
+def ensure(conn):
+    with conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS measurements(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            city TEXT,
+            timestamp TEXT,
+            aqi INTEGER,
+            pm25 REAL,
+            pm10 REAL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_city_aqi ON measurements(city, aqi)")
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='city_latest'").fetchone()
+        conn.execute("""CREATE TABLE IF NOT EXISTS city_latest(
+            city TEXT PRIMARY KEY,
+            timestamp TEXT,
+            aqi INTEGER,
+            pm25 REAL,
+            pm10 REAL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_city_latest_aqi ON city_latest(aqi)")
+        if not exists:
+            # backfill from history; sqlite takes the bare columns from the MAX(timestamp) row
+            conn.execute("""INSERT OR IGNORE INTO city_latest(city, timestamp, aqi, pm25, pm10)
+                SELECT city, MAX(timestamp), aqi, pm25, pm10 FROM measurements GROUP BY city""")
 
 def save_measurement(city, ts_iso, aqi=None, pm25=None, pm10=None):
-    ensure()
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO measurements(city, timestamp, aqi, pm25, pm10) VALUES (?,?,?,?,?)",
-                (city, ts_iso, aqi, pm25, pm10))
-    conn.commit()
-    conn.close()
+    with _LOCK:
+        conn = _connect()
+        with conn:
+            conn.execute(_INSERT_SQL, (city, ts_iso, aqi, pm25, pm10))
+            conn.execute(_UPSERT_LATEST_SQL, (city, ts_iso, aqi, pm25, pm10))
+
+def save_measurements_bulk(rows):
+    # rows: iterable of (city, ts_iso, aqi, pm25, pm10), written in a single transaction
+    rows = list(rows)
+    with _LOCK:
+        conn = _connect()
+        with conn:
+            conn.executemany(_INSERT_SQL, rows)
+            conn.executemany(_UPSERT_LATEST_SQL, rows)
 
 def get_top_cities(limit=10):
-    ensure()
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT city, MAX(COALESCE(aqi,0)) as aqi FROM measurements GROUP BY city ORDER BY aqi DESC LIMIT ?", (limit,))
-    rows = cur.fetchall()
-    conn.close()
-    return [{"city":r[0], "aqi": r[1]} for r in rows]
+    with _LOCK:
+        rows = _connect().execute("SELECT city, aqi FROM city_latest ORDER BY aqi DESC LIMIT ?", (limit,)).fetchall()
+    # NULLs sort last under DESC, so they can be reported as 0 here without breaking the index order
+    return [{"city":r[0], "aqi": r[1] or 0} for r in rows]
@@ -1,14 +1,21 @@
 # app/main.py
+import asyncio
+import contextlib
+import os
+import httpx
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # import router from endpoints (must exist at app/api/endpoints.py)
-from app.api.endpoints import router as api_router
+from app.api.endpoints import OPENAQ_BASE, redis, router as api_router
+from app.api.ingest import start_scheduler
 
 app = FastAPI(
     title="AQI India Backend",
     description="Backend API for AQI India project",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Only allow your production frontend origin
@@ -17,13 +24,48 @@ origins = [
     "https://www.aqiindia.live",
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# set CORS_AT_PROXY=1 when the reverse proxy in front of uvicorn answers CORS, to drop the middleware entirely
+if os.getenv("CORS_AT_PROXY") != "1":
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+async def warm_upstream(client: httpx.AsyncClient):
+    # open the pooled connection (DNS + TCP + TLS) before the first real request needs it
+    try:
+        await client.head(OPENAQ_BASE)
+    except Exception as e:
+        print("warm_upstream error:", str(e))
+
+
+@app.on_event("startup")
+async def startup_event():
+    # one pooled client for all upstream calls, so connections stay warm across requests
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        # keep idle connections for a while so lookups and handshakes aren't redone between requests
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(20.0, connect=5.0),
+        # httpx decodes these transparently; br needs the brotli extra
+        headers={"Accept-Encoding": "gzip, br", "Accept": "application/json"},
+    )
+    app.state.warmup = asyncio.create_task(warm_upstream(app.state.http))
+    app.state.scheduler = start_scheduler(app.state.http)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.scheduler.shutdown(wait=False)
+    # don't close the client under a warmup request that is still running
+    app.state.warmup.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.warmup
+    await app.state.http.aclose()
+    await redis.aclose()
 
 # mount the API router at /api
 app.include_router(api_router, prefix="/api")
@@ -0,0 +1,14 @@
+import pytest
+
+from app import db
+
+
+@pytest.fixture(autouse=True)
+def db_file(tmp_path, monkeypatch):
+    # every test gets its own database; the app's aqi.db is never opened
+    path = tmp_path / "aqi.db"
+    monkeypatch.setattr(db, "DB_FILE", path)
+    monkeypatch.setattr(db, "_CONN", None)
+    yield path
+    if db._CONN is not None:
+        db._CONN.close()
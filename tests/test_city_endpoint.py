@@ -0,0 +1,104 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import orjson
+import pytest
+
+from app.api import endpoints
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    # no redis in tests, and no results left over from other tests
+    async def cache_get(key):
+        return None
+
+    async def cache_set(key, raw):
+        return None
+
+    monkeypatch.setattr(endpoints, "cache_get", cache_get)
+    monkeypatch.setattr(endpoints, "cache_set", cache_set)
+    endpoints._city_cache.clear()
+    endpoints._inflight.clear()
+    yield
+    endpoints._city_cache.clear()
+    endpoints._inflight.clear()
+
+
+def mock_client(calls, latest):
+    async def handler(request):
+        calls[request.url.path] += 1
+        # stay in flight long enough for concurrent requests to pile up
+        await asyncio.sleep(0.01)
+        if request.url.path.endswith("/latest"):
+            return httpx.Response(200, content=orjson.dumps(latest))
+        return httpx.Response(200, content=b'{"results": []}')
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+LATEST_DELHI = {"results": [{"measurements": [
+    {"parameter": "pm25", "value": 45.0, "lastUpdated": "2024-01-01T00:00:00Z"},
+    {"parameter": "pm10", "value": 80.0},
+]}]}
+
+
+def test_concurrent_requests_share_one_upstream_fetch():
+    calls = Counter()
+
+    async def run():
+        async with mock_client(calls, LATEST_DELHI) as client:
+            responses = await asyncio.gather(*(endpoints.city_endpoint("Delhi", client) for _ in range(10)))
+            return responses
+
+    responses = asyncio.run(run())
+    bodies = {r.body for r in responses}
+    assert len(bodies) == 1
+    assert orjson.loads(bodies.pop())["aqi"] == 80
+    assert calls["/v3/latest"] == 1
+    assert all(n <= 1 for n in calls.values()), calls
+    assert not endpoints._inflight
+
+
+def test_warm_cache_makes_no_upstream_calls():
+    calls = Counter()
+
+    async def run():
+        async with mock_client(calls, LATEST_DELHI) as client:
+            first = await endpoints.city_endpoint("Delhi", client)
+            before = sum(calls.values())
+            second = await endpoints.city_endpoint("Delhi", client)
+            return first, second, before
+
+    first, second, before = asyncio.run(run())
+    assert second.body == first.body
+    assert sum(calls.values()) == before
+
+
+def test_no_measurements_result_is_not_cached():
+    calls = Counter()
+
+    async def run():
+        async with mock_client(calls, {"results": []}) as client:
+            return await endpoints.city_endpoint("Nowhere", client)
+
+    body = orjson.loads(asyncio.run(run()).body)
+    assert body == {"city": "Nowhere", "message": "No measurements found for PM2.5 or PM10"}
+    assert "Nowhere" not in endpoints._city_cache
+
+
+def test_nan_reading_is_not_scored():
+    calls = Counter()
+    latest = {"results": [{"measurements": [
+        {"parameter": "pm25", "value": "NaN"},
+        {"parameter": "pm10", "value": 80.0},
+    ]}]}
+
+    async def run():
+        async with mock_client(calls, latest) as client:
+            return await endpoints.city_endpoint("Delhi", client)
+
+    body = orjson.loads(asyncio.run(run()).body)
+    assert body["aqi"] == 80
+    assert body["subindex"] == {"pm25": None, "pm10": 80}
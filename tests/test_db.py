@@ -0,0 +1,43 @@
+import sqlite3
+
+from app import db
+
+
+def latest_rows():
+    with db._LOCK:
+        return db._connect().execute("SELECT city, timestamp, aqi, pm25, pm10 FROM city_latest ORDER BY city").fetchall()
+
+
+def test_older_reading_does_not_overwrite_latest():
+    db.save_measurement("Delhi", "2024-01-02T00:00:00", 150, 60.0, 90.0)
+    db.save_measurements_bulk([("Delhi", "2024-01-01T00:00:00", 300, 100.0, 200.0)])
+    assert latest_rows() == [("Delhi", "2024-01-02T00:00:00", 150, 60.0, 90.0)]
+    # history still keeps both readings
+    with db._LOCK:
+        assert db._connect().execute("SELECT COUNT(*) FROM measurements").fetchone() == (2,)
+
+
+def test_newer_reading_replaces_latest():
+    db.save_measurement("Delhi", "2024-01-01T00:00:00", 300, 100.0, 200.0)
+    db.save_measurement("Delhi", "2024-01-02T00:00:00", 150, 60.0, 90.0)
+    assert latest_rows() == [("Delhi", "2024-01-02T00:00:00", 150, 60.0, 90.0)]
+
+
+def test_backfill_picks_latest_row_per_city(db_file):
+    # a database from before city_latest existed
+    conn = sqlite3.connect(db_file)
+    conn.execute("""CREATE TABLE measurements(
+        id INTEGER PRIMARY KEY AUTOINCREMENT, city TEXT, timestamp TEXT, aqi INTEGER, pm25 REAL, pm10 REAL)""")
+    conn.executemany("INSERT INTO measurements(city, timestamp, aqi, pm25, pm10) VALUES (?,?,?,?,?)", [
+        ("Delhi", "2024-01-01T00:00:00", 300, 100.0, 200.0),
+        ("Delhi", "2024-01-03T00:00:00", 120, 50.0, 70.0),
+        ("Delhi", "2024-01-02T00:00:00", 200, 80.0, 150.0),
+        ("Mumbai", "2024-01-01T00:00:00", None, None, 40.0),
+    ])
+    conn.commit()
+    conn.close()
+    assert latest_rows() == [
+        ("Delhi", "2024-01-03T00:00:00", 120, 50.0, 70.0),
+        ("Mumbai", "2024-01-01T00:00:00", None, None, 40.0),
+    ]
+    assert db.get_top_cities() == [{"city": "Delhi", "aqi": 120}, {"city": "Mumbai", "aqi": 0}]
@@ -0,0 +1,88 @@
+import asyncio
+
+import msgspec
+
+from app.api import endpoints
+
+
+def decode_latest(raw):
+    return msgspec.json.decode(raw, type=endpoints.LatestPayload, strict=False)
+
+
+def test_extract_from_latest_skips_non_numeric_value():
+    payload = decode_latest(b'{"results":[{"measurements":['
+                            b'{"parameter":"pm25","value":"N/A"},'
+                            b'{"parameter":"pm10","value":110,"lastUpdated":"2024-01-01T00:00:00Z"}]}]}')
+    assert endpoints.extract_from_latest(payload) == (None, 110.0, "2024-01-01T00:00:00Z")
+
+
+def test_extract_from_latest_accepts_numeric_strings_and_first_match():
+    payload = decode_latest(b'{"results":[{"measurements":['
+                            b'{"parameter":"o3","value":3},'
+                            b'{"parameter":"PM2.5","value":"12.5"},'
+                            b'{"parameter":"pm25","value":99}]},'
+                            b'{"measurements":null},'
+                            b'{"measurements":[{"parameter":"pm10","value":40}]}]}')
+    assert endpoints.extract_from_latest(payload) == (12.5, 40.0, None)
+
+
+EMPTY = (None, None, None)
+
+
+async def source(delay, result=EMPTY, exc=None, cancelled=None):
+    # stub OpenAQ source: waits, then returns a reading or raises; records if it was cancelled
+    try:
+        await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        if cancelled is not None:
+            cancelled.append(True)
+        raise
+    if exc is not None:
+        raise exc
+    return result
+
+
+def test_first_measurement_prefers_slower_earlier_source():
+    result = asyncio.run(endpoints.first_measurement(
+        source(0.05, (10.0, None, "a")),
+        source(0.0, (20.0, 30.0, "b")),
+    ))
+    assert result == (10.0, None, "a")
+
+
+def test_first_measurement_skips_failed_source():
+    result = asyncio.run(endpoints.first_measurement(
+        source(0.0, exc=RuntimeError("upstream down")),
+        source(0.01, (None, 40.0, "b")),
+    ))
+    assert result == (None, 40.0, "b")
+
+
+def test_first_measurement_cancels_pending_sources():
+    cancelled = []
+
+    async def run():
+        result = await endpoints.first_measurement(
+            source(0.0, (10.0, 20.0, "a")),
+            source(10, (1.0, 2.0, "b"), cancelled=cancelled),
+        )
+        # let the cancellation be delivered, and check before asyncio.run cleans up leftover tasks
+        await asyncio.sleep(0)
+        assert cancelled == [True]
+        return result
+
+    assert asyncio.run(run()) == (10.0, 20.0, "a")
+
+
+def test_first_measurement_all_empty():
+    result = asyncio.run(endpoints.first_measurement(source(0.0), source(0.01), source(0.0)))
+    assert result == EMPTY
+
+
+def test_pm_slot():
+    assert endpoints.pm_slot("PM2.5", None, None) == "pm25"
+    assert endpoints.pm_slot("pm25", 1.0, None) is None
+    assert endpoints.pm_slot("pm10", None, None) == "pm10"
+    assert endpoints.pm_slot("pm10", None, 1.0) is None
+    assert endpoints.pm_slot("o3", None, None) is None
+    assert endpoints.pm_slot(None, None, None) is None
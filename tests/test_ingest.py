@@ -0,0 +1,20 @@
+from app.api import ingest
+
+
+def test_parse_latest_skips_non_numeric_values():
+    data = {"results": [{"measurements": [
+        {"parameter": "pm25", "value": "bad"},
+        {"parameter": "pm10", "value": 80},
+    ]}]}
+    assert ingest.parse_latest(data) == (None, 80.0)
+
+
+def test_save_batch_survives_one_bad_city(monkeypatch):
+    saved = []
+    monkeypatch.setattr(ingest, "save_measurements_bulk", saved.extend)
+    readings = []
+    for city, value in (("Delhi", "N/A"), ("Mumbai", 45)):
+        parsed = ingest.parse_latest({"results": [{"measurements": [{"parameter": "pm25", "value": value}]}]})
+        readings.append((city, *parsed))
+    ingest.save_batch(readings)
+    assert [(r[0], r[2]) for r in saved] == [("Delhi", None), ("Mumbai", 76)]
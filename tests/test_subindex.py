@@ -0,0 +1,55 @@
+import pytest
+
+from app.api import endpoints
+
+
+def baseline_subindex(conc, breakpoints):
+    # the original linear-scan implementation, kept as the oracle for the faster lookups
+    if conc is None:
+        return None
+    for C_low, C_high, I_low, I_high in breakpoints:
+        if C_low <= conc <= C_high:
+            span_C = C_high - C_low
+            if span_C == 0:
+                return int(round(float(I_low)))
+            slope = (I_high - I_low) / span_C
+            return int(round(slope * (conc - C_low) + I_low))
+    if conc > breakpoints[-1][1]:
+        Clow, Chigh, Ilow, Ihigh = breakpoints[-1]
+        span_C = (Chigh - Clow) if (Chigh - Clow) != 0 else 1
+        slope = (Ihigh - Ilow) / span_C
+        return int(round(slope * (conc - Clow) + Ilow))
+    return None
+
+
+# 0.01 steps from below the table to past the last breakpoint, plus None and NaN
+GRID = [None, float("nan")] + [i / 100 for i in range(-100, 120001)]
+
+CASES = [
+    (endpoints.PM25_BREAKPOINTS, endpoints.get_subindex_pm25),
+    (endpoints.PM10_BREAKPOINTS, endpoints.get_subindex_pm10),
+]
+BATCH_CASES = [
+    (endpoints.PM25_BREAKPOINTS, endpoints.PM25_ARRAYS),
+    (endpoints.PM10_BREAKPOINTS, endpoints.PM10_ARRAYS),
+]
+
+
+@pytest.mark.parametrize("breakpoints,fn", CASES)
+def test_generated_subindex_matches_baseline(breakpoints, fn):
+    for conc in GRID:
+        assert fn(conc) == baseline_subindex(conc, breakpoints), conc
+
+
+@pytest.mark.parametrize("conc,expected", [(2.7, 5), (12.3, 21), (18.3, 31), (18.9, 32), (30.0, 50), (-1.0, None)])
+def test_get_subindex_pm25_rounding(conc, expected):
+    assert endpoints.get_subindex_pm25(conc) == expected
+
+
+@pytest.mark.parametrize("breakpoints,arrays", BATCH_CASES)
+def test_get_subindex_batch_matches_baseline(breakpoints, arrays):
+    assert endpoints.get_subindex_batch(GRID, arrays) == [baseline_subindex(c, breakpoints) for c in GRID]
+
+
+def test_get_subindex_batch_empty():
+    assert endpoints.get_subindex_batch([], endpoints.PM25_ARRAYS) == []